@@ -126,8 +126,10 @@ class PdfConverter(BaseConverter):
             renderer = MarkdownRenderer
 
         if llm_service:
-            llm_service_cls = strings_to_classes([llm_service])[0]
-            llm_service = self.resolve_dependencies(llm_service_cls)
+            # A service instance can be shared by several converters, e.g. so they share its rate limit
+            if isinstance(llm_service, str):
+                llm_service_cls = strings_to_classes([llm_service])[0]
+                llm_service = self.resolve_dependencies(llm_service_cls)
             # 传递output_format配置
             if hasattr(llm_service, 'output_format'):
                 llm_service.output_format = self.llm_service_config.get('output_format', 'markdown')
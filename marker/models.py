@@ -4,18 +4,156 @@ from surya.recognition import RecognitionPredictor
 from surya.ocr_error import OCRErrorPredictor
 from surya.layout import LayoutPredictor
 from surya.detection import DetectionPredictor, InlineDetectionPredictor
+import logging
 import os
+import threading
+from collections.abc import MutableMapping
+from typing import Any, Dict, Iterator, Tuple
+
+import torch
+from surya.settings import settings as surya_settings
+
+from marker.settings import settings
 # Transformers uses .isin for an op, which is not supported on MPS
 os.environ["PYTORCH_ENABLE_MPS_FALLBACK"] = "1"
 
+MODEL_CLASSES = {
+    "layout_model": LayoutPredictor,
+    "texify_model": TexifyPredictor,
+    "recognition_model": RecognitionPredictor,
+    "table_rec_model": TableRecPredictor,
+    "detection_model": DetectionPredictor,
+    "inline_detection_model": InlineDetectionPredictor,
+    "ocr_error_model": OCRErrorPredictor,
+}
+
+logger = logging.getLogger(__name__)
+
+# Loaded predictors, keyed by (predictor class, device, dtype), so repeated conversions in one process share weights
+_MODEL_CACHE: Dict[Tuple[type, Any, Any], Any] = {}
+_MODEL_CACHE_LOCK = threading.Lock()
+
+
+def load_model(predictor_cls: type, device=None, dtype=None):
+    key = (predictor_cls, device, dtype)
+    with _MODEL_CACHE_LOCK:
+        if key not in _MODEL_CACHE:
+            model_device = device or settings.TORCH_DEVICE_MODEL
+            if settings.COMPILE_MODELS and model_device == "cuda":
+                # Surya's loaders compile the encoder and decoder and switch to a static KV cache.
+                # Compiling the wrapper model would miss them, since inference calls the submodules directly.
+                # Compilation happens on the first batch, so the first document converted is slower
+                surya_settings.COMPILE_ALL = True
+            predictor = predictor_cls(device=device, dtype=dtype)
+            if settings.MODEL_QUANTIZATION == "int8":
+                if model_device == "cpu":
+                    predictor.model = torch.ao.quantization.quantize_dynamic(
+                        predictor.model, {torch.nn.Linear}, dtype=torch.qint8
+                    )
+                else:
+                    logger.warning("MODEL_QUANTIZATION=int8 is only supported on cpu, not %s", model_device)
+            _MODEL_CACHE[key] = predictor
+        return _MODEL_CACHE[key]
+
+
+def clear_model_cache():
+    with _MODEL_CACHE_LOCK:
+        _MODEL_CACHE.clear()
+
+
+class LockedPredictor:
+    """
+    Serializes calls to a predictor shared between threads.  Surya predictors keep per-batch state on the
+    model, like the static KV cache, so concurrent calls would overwrite each other's state.
+    Attribute access is passed through to the predictor.
+    """
+    def __init__(self, predictor, lock: threading.RLock):
+        object.__setattr__(self, "_predictor", predictor)
+        object.__setattr__(self, "_lock", lock)
+
+    def __call__(self, *args, **kwargs):
+        # Re-entrant, since the recognition predictor calls the detection predictor
+        with self._lock:
+            return self._predictor(*args, **kwargs)
+
+    def __getattr__(self, name: str):
+        return getattr(self._predictor, name)
+
+    def __setattr__(self, name: str, value):
+        setattr(self._predictor, name, value)
+
+
+class LazyModelDict(MutableMapping):
+    """
+    An artifact dict that only loads each model the first time it is accessed.
+    Other artifacts, like the llm service, can be set on it like a regular dict.
+    With thread_safe, models are wrapped so converters running in different threads take turns on them.
+    """
+    def __init__(self, device=None, dtype=None, thread_safe: bool = False):
+        self.device = device
+        self.dtype = dtype
+        self._model_classes = dict(MODEL_CLASSES)
+        self._items: Dict[str, Any] = {}
+        self._inference_lock = threading.RLock() if thread_safe else None
+        self._load_lock = threading.Lock()
+
+    def __getitem__(self, key: str):
+        if key not in self._items:
+            with self._load_lock:
+                if key not in self._items:
+                    if key not in self._model_classes:
+                        raise KeyError(key)
+                    model = load_model(self._model_classes[key], self.device, self.dtype)
+                    if self._inference_lock is not None:
+                        model = LockedPredictor(model, self._inference_lock)
+                    self._items[key] = model
+        return self._items[key]
+
+    def __getstate__(self):
+        # Locks can't be pickled, e.g. when scripts/convert.py sends the dict to its worker processes
+        state = self.__dict__.copy()
+        state["locked_keys"] = [k for k, v in self._items.items() if isinstance(v, LockedPredictor)]
+        state["_items"] = {
+            k: v._predictor if isinstance(v, LockedPredictor) else v
+            for k, v in self._items.items()
+        }
+        state["thread_safe"] = state.pop("_inference_lock") is not None
+        del state["_load_lock"]
+        return state
+
+    def __setstate__(self, state):
+        thread_safe = state.pop("thread_safe")
+        locked_keys = state.pop("locked_keys")
+        self.__dict__.update(state)
+        self._inference_lock = threading.RLock() if thread_safe else None
+        self._load_lock = threading.Lock()
+        for key in locked_keys:
+            self._items[key] = LockedPredictor(self._items[key], self._inference_lock)
+
+    def __setitem__(self, key: str, value):
+        self._model_classes.pop(key, None)
+        self._items[key] = value
+
+    def __delitem__(self, key: str):
+        if key not in self:
+            raise KeyError(key)
+        self._model_classes.pop(key, None)
+        self._items.pop(key, None)
+
+    def __contains__(self, key) -> bool:
+        # Checked by dependency resolution, so this must not load the model
+        return key in self._items or key in self._model_classes
+
+    def __iter__(self) -> Iterator[str]:
+        yield from self._items
+        yield from [k for k in self._model_classes if k not in self._items]
+
+    def __len__(self) -> int:
+        return len(self._items.keys() | self._model_classes.keys())
+
 
-def create_model_dict(device=None, dtype=None) -> dict:
-    return {
-        "layout_model": LayoutPredictor(device=device, dtype=dtype),
-        "texify_model": TexifyPredictor(device=device, dtype=dtype),
-        "recognition_model": RecognitionPredictor(device=device, dtype=dtype),
-        "table_rec_model": TableRecPredictor(device=device, dtype=dtype),
-        "detection_model": DetectionPredictor(device=device, dtype=dtype),
-        "inline_detection_model": InlineDetectionPredictor(device=device, dtype=dtype),
-        "ocr_error_model": OCRErrorPredictor(device=device, dtype=dtype)
-    }
+def create_model_dict(device=None, dtype=None, thread_safe: bool = False) -> LazyModelDict:
+    if dtype is None and (device or settings.TORCH_DEVICE_MODEL) == "mps":
+        # The predictors pick their own dtype elsewhere, but run in fp16 on MPS
+        dtype = settings.MODEL_DTYPE
+    return LazyModelDict(device=device, dtype=dtype, thread_safe=thread_safe)
@@ -24,6 +24,12 @@ class LLMSimpleBlockMetaProcessor(BaseLLMProcessor):
         pbar = tqdm(desc=f"LLM processors running", disable=self.disable_tqdm, total=total)
 
         all_prompts = [processor.block_prompts(document) for processor in self.processors]
+        # Only real services opt in; test doubles and duck-typed services keep the per-prompt path
+        if isinstance(self.llm_service, BaseService) and self.llm_service.batch_enabled():
+            self.run_batch(all_prompts, document, pbar)
+            pbar.close()
+            return
+
         pending = []
         futures_map = {}
         with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
@@ -50,5 +56,30 @@ class LLMSimpleBlockMetaProcessor(BaseLLMProcessor):
 
         pbar.close()
 
+    def run_batch(self, all_prompts: List[List[Dict[str, Any]]], document: Document, pbar: tqdm):
+        flat_prompts = [(i, prompt) for i, prompt_lst in enumerate(all_prompts) for prompt in prompt_lst]
+        if not flat_prompts:
+            return
+
+        try:
+            results = self.llm_service.batch([prompt for _, prompt in flat_prompts])
+        except Exception as e:
+            # Like a failed single request, a failed batch leaves the blocks unchanged instead of failing the document
+            print(f"Error running LLM batch: {e}")
+            results = [{} for _ in flat_prompts]
+
+        if len(results) != len(flat_prompts):
+            print(f"Error running LLM batch: expected {len(flat_prompts)} results, got {len(results)}")
+            results = [{} for _ in flat_prompts]
+
+        for (processor_idx, prompt_data), result in zip(flat_prompts, results):
+            try:
+                processor: BaseLLMSimpleBlockProcessor = self.processors[processor_idx]
+                processor(result, prompt_data, document)
+            except Exception as e:
+                print(f"Error processing LLM response: {e}")
+
+            pbar.update(1)
+
     def get_response(self, prompt_data: Dict[str, Any]):
         return self.llm_service(prompt_data["prompt"], prompt_data["image"], prompt_data["block"], prompt_data["schema"])
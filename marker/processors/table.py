@@ -13,6 +13,7 @@ from surya.table_rec.schema import TableResult, TableCell as SuryaTableCell
 from pdftext.extraction import table_output
 
 from marker.processors import BaseProcessor
+from marker.providers.pdf import PDFIUM_LOCK
 from marker.schema import BlockTypes
 from marker.schema.blocks.tablecell import TableCell
 from marker.schema.document import Document
@@ -362,7 +363,8 @@ class TableProcessor(BaseProcessor):
                 "tables": tables,
                 "img_size": img_size
             })
-        cell_text = table_output(filepath, table_inputs, page_range=unique_pages, workers=self.pdftext_workers)
+        with PDFIUM_LOCK:
+            cell_text = table_output(filepath, table_inputs, page_range=unique_pages, workers=self.pdftext_workers)
         assert len(cell_text) == len(unique_pages), "Number of pages and table inputs must match"
 
         for pidx, (page_tables, pnum) in enumerate(zip(cell_text, unique_pages)):
@@ -2,6 +2,7 @@ import contextlib
 import ctypes
 import logging
 import re
+import threading
 from typing import Annotated, Dict, List, Optional, Set
 
 import pypdfium2 as pdfium
@@ -25,6 +26,10 @@ from marker.schema.text.span import Span
 # Ignore pypdfium2 warning about form flattening
 logging.getLogger("pypdfium2").setLevel(logging.ERROR)
 
+# PDFium is not thread-safe, even across documents, so all PDFium work in a process takes this lock.
+# Re-entrant, since pdftext opens the document again while the provider holds it.
+PDFIUM_LOCK = threading.RLock()
+
 
 class PdfProvider(BaseProvider):
     """
@@ -108,17 +113,18 @@ class PdfProvider(BaseProvider):
     @contextlib.contextmanager
     def get_doc(self):
         doc = None
-        try:
-            doc = pdfium.PdfDocument(self.filepath)
-
-            # Must be called on the parent pdf, before retrieving pages to render correctly
-            if self.flatten_pdf:
-                doc.init_forms()
-
-            yield doc
-        finally:
-            if doc:
-                doc.close()
+        with PDFIUM_LOCK:
+            try:
+                doc = pdfium.PdfDocument(self.filepath)
+
+                # Must be called on the parent pdf, before retrieving pages to render correctly
+                if self.flatten_pdf:
+                    doc.init_forms()
+
+                yield doc
+            finally:
+                if doc:
+                    doc.close()
 
     def __len__(self) -> int:
         return self.page_count
@@ -17,7 +17,7 @@ import gc
 from marker.config.parser import ConfigParser
 from marker.config.printer import CustomClickPrinter
 from marker.logger import configure_logging
-from marker.models import create_model_dict
+from marker.models import clear_model_cache, create_model_dict
 from marker.output import output_exists, save_output
 from marker.settings import settings
 
@@ -41,6 +41,7 @@ def worker_exit():
         del model_refs
     except Exception:
         pass
+    clear_model_cache()
 
 
 def process_single_pdf(args):
@@ -133,4 +134,5 @@ def convert_cli(in_folder: str, **kwargs):
         pbar.close()
 
     # Delete all CUDA tensors
-    del model_dict
\ No newline at end of file
+    del model_dict
+    clear_model_cache()
\ No newline at end of file
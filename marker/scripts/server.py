@@ -16,7 +16,7 @@ import io
 
 from fastapi import FastAPI, Form, File, UploadFile
 from marker.converters.pdf import PdfConverter
-from marker.models import create_model_dict
+from marker.models import clear_model_cache, create_model_dict
 from marker.settings import settings
 
 app_data = {}
@@ -34,6 +34,7 @@ async def lifespan(app: FastAPI):
 
     if "models" in app_data:
         del app_data["models"]
+    clear_model_cache()
 
 
 app = FastAPI(lifespan=lifespan)
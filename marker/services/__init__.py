@@ -32,4 +32,11 @@ class BaseService:
         max_retries: int | None = None,
         timeout: int | None = None
      ):
+        raise NotImplementedError
+
+    def batch_enabled(self) -> bool:
+        # Services that return True get all simple block prompts at once through `batch`
+        return False
+
+    def batch(self, prompts: List[dict]) -> List[dict]:
         raise NotImplementedError
\ No newline at end of file
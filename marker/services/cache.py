@@ -0,0 +1,50 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class ResponseCache:
+    """
+    A sqlite-backed store of LLM responses, so re-running a document skips identical requests.
+    Safe to share between the threads that issue LLM requests.  Errors are logged and treated as a cache miss,
+    so a locked or broken database never costs a response.
+    """
+    def __init__(self, path: str, timeout: float = 30.):
+        dirname = os.path.dirname(path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+
+        self._lock = threading.Lock()
+        # Worker processes can share one cache file, so wait for their writes instead of failing immediately
+        self._conn = sqlite3.connect(path, timeout=timeout, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, response TEXT NOT NULL)")
+
+    def get(self, key: str) -> dict | None:
+        try:
+            with self._lock:
+                row = self._conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+        except sqlite3.Error as e:
+            logger.warning("Could not read the LLM response cache: %s", e)
+            return None
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    def set(self, key: str, response: dict):
+        try:
+            with self._lock, self._conn:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO responses (key, response) VALUES (?, ?)",
+                    (key, json.dumps(response, ensure_ascii=False))
+                )
+        except sqlite3.Error as e:
+            logger.warning("Could not write to the LLM response cache: %s", e)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -1,17 +1,86 @@
 import base64
+import functools
+import hashlib
 import json
+import logging
+import random
+import re
+import struct
+import threading
 import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
-from typing import Annotated, List, Union
+from typing import Annotated, List, Optional, Union
 
 import openai
 import PIL
-from openai import APITimeoutError, RateLimitError
+from openai import APIConnectionError, InternalServerError, RateLimitError
 from PIL import Image
-from pydantic import BaseModel
+from pydantic import BaseModel, ValidationError
 
 from marker.schema.blocks import Block
 from marker.services import BaseService
+from marker.services.cache import ResponseCache
+from marker.settings import settings
+
+logger = logging.getLogger(__name__)
+
+# Shared across calls so threads aren't recreated per request.  PIL releases the GIL while encoding.
+_ENCODE_EXECUTOR = ThreadPoolExecutor(max_workers=8, thread_name_prefix="marker-image-encode")
+
+_RESET_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def strict_json_schema(schema: dict) -> dict:
+    # Structured outputs in strict mode need every property required and no extra properties
+    schema = dict(schema)
+    if schema.get("type") == "object" and "properties" in schema:
+        schema["properties"] = {k: strict_json_schema(v) for k, v in schema["properties"].items()}
+        schema["required"] = list(schema["properties"])
+        schema["additionalProperties"] = False
+    if isinstance(schema.get("items"), dict):
+        schema["items"] = strict_json_schema(schema["items"])
+    for key in ("anyOf", "allOf"):
+        if key in schema:
+            schema[key] = [strict_json_schema(s) for s in schema[key]]
+    if "$defs" in schema:
+        schema["$defs"] = {k: strict_json_schema(v) for k, v in schema["$defs"].items()}
+    if "default" in schema and schema["default"] is None:
+        schema.pop("default")
+    return schema
+
+
+@functools.lru_cache(maxsize=None)
+def response_format_for(response_schema: type[BaseModel]) -> dict:
+    # Built once per schema class, instead of the SDK re-deriving it on every parse() call
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": response_schema.__name__,
+            "schema": strict_json_schema(response_schema.model_json_schema()),
+            "strict": True,
+        },
+    }
+
+
+def parse_header_number(value: str | None) -> float | None:
+    # OpenAI-compatible providers don't all send integers, so parse leniently and ignore junk
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_reset_seconds(value: str | None) -> float:
+    # OpenAI reports rate limit resets like "20ms", "1s" or "6m0s"
+    if not value:
+        return 0.
+    try:
+        return sum(float(amount) * _RESET_UNITS[unit] for amount, unit in re.findall(r"([\d.]+)(ms|s|m|h)", value))
+    except ValueError:
+        return 0.
+
 
 class OpenAIService(BaseService):
     openai_base_url: Annotated[
@@ -26,11 +95,135 @@ class OpenAIService(BaseService):
         str,
         "The API key to use for the OpenAI-like service."
     ] = None
+    openai_image_format: Annotated[
+        str,
+        "The format images are encoded in before upload: JPEG, WEBP or PNG.  JPEG is much faster to encode."
+    ] = "JPEG"
+    openai_image_quality: Annotated[
+        int,
+        "The encoder quality to use for lossy image formats."
+    ] = 80
+    openai_max_image_dim: Annotated[
+        int,
+        "Images are downscaled so their longest side is at most this many pixels.  Vision models don't use more detail."
+    ] = 2048
+    openai_prompt_cache: Annotated[
+        bool,
+        "Send a prompt_cache_key so requests built from the same prompt template share the provider's prompt cache.  Only the OpenAI API supports this."
+    ] = False
+    openai_max_validation_retries: Annotated[
+        int,
+        "The maximum number of immediate retries when the response is not valid JSON for the schema."
+    ] = 2
+    openai_batch_mode: Annotated[
+        bool,
+        "Submit simple block requests through the OpenAI Batch API.  Cheaper, but results can take up to 24h."
+    ] = False
+    openai_batch_poll_interval: Annotated[
+        int,
+        "The number of seconds to wait between batch status checks."
+    ] = 30
+    openai_cache_path: Annotated[
+        str,
+        "Path to a sqlite file used to cache responses across runs.  Leave empty to disable caching."
+    ] = ""
+    openai_image_cache_size: Annotated[
+        int,
+        "The number of encoded images to keep in memory, so repeated images and retries skip re-encoding."
+    ] = 256
+
+    def __init__(self, config: Optional[BaseModel | dict] = None):
+        super().__init__(config)
+
+        self._image_url_cache: OrderedDict[bytes, str] = OrderedDict()
+        self._image_url_cache_lock = threading.Lock()
+
+        # Requests are issued from the processors' thread pools, so the rate limit pause is shared
+        self._rate_limit_lock = threading.Lock()
+        self._rate_limit_until = 0.
+
+        self.response_cache = None
+        if self.openai_cache_path:
+            self.response_cache = ResponseCache(self.openai_cache_path)
+
+        # One client per service, so the connection pool (and TLS sessions) are reused across requests
+        self._client: openai.OpenAI | None = None
+        self._client_lock = threading.Lock()
+
+    def wait_for_rate_limit(self):
+        with self._rate_limit_lock:
+            wait_time = self._rate_limit_until - time.monotonic()
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+    @staticmethod
+    def retry_after(error: RateLimitError) -> float | None:
+        headers = error.response.headers if error.response is not None else {}
+        for header, scale in (("retry-after-ms", 0.001), ("retry-after", 1)):
+            try:
+                return float(headers[header]) * scale
+            except (KeyError, TypeError, ValueError):
+                continue
+        return None
+
+    def pause_requests(self, seconds: float):
+        # Every thread waits in wait_for_rate_limit, not just the one that hit the limit
+        if seconds > 0:
+            with self._rate_limit_lock:
+                self._rate_limit_until = max(self._rate_limit_until, time.monotonic() + seconds)
+
+    def update_rate_limit(self, headers, tokens_used: int = 0):
+        pause = 0.
+        remaining_requests = parse_header_number(headers.get("x-ratelimit-remaining-requests"))
+        if remaining_requests is not None and remaining_requests <= 0:
+            pause = max(pause, parse_reset_seconds(headers.get("x-ratelimit-reset-requests")))
+
+        # Back off if the next request of a similar size would exceed the token budget
+        remaining_tokens = parse_header_number(headers.get("x-ratelimit-remaining-tokens"))
+        if remaining_tokens is not None and remaining_tokens <= tokens_used:
+            pause = max(pause, parse_reset_seconds(headers.get("x-ratelimit-reset-tokens")))
+
+        self.pause_requests(pause)
+
+    def image_cache_key(self, image: PIL.Image.Image) -> bytes:
+        digest = hashlib.blake2b(image.tobytes(), digest_size=16).digest()
+        return digest + struct.pack("II", *image.size) + image.mode.encode()
+
+    def image_url(self, image: PIL.Image.Image) -> str:
+        key = self.image_cache_key(image)
+        with self._image_url_cache_lock:
+            cached = self._image_url_cache.get(key)
+            if cached is not None:
+                self._image_url_cache.move_to_end(key)
+                return cached
+
+        url = self.render_image_url(image)
+        with self._image_url_cache_lock:
+            self._image_url_cache[key] = url
+            while len(self._image_url_cache) > self.openai_image_cache_size:
+                self._image_url_cache.popitem(last=False)
+        return url
+
+    def render_image_url(self, image: PIL.Image.Image) -> str:
+        if max(image.size) > self.openai_max_image_dim:
+            # thumbnail works in place and keeps the aspect ratio
+            image = image.copy()
+            image.thumbnail((self.openai_max_image_dim, self.openai_max_image_dim), Image.Resampling.LANCZOS)
 
-    def image_to_base64(self, image: PIL.Image.Image):
         image_bytes = BytesIO()
-        image.save(image_bytes, format="WEBP")
-        return base64.b64encode(image_bytes.getvalue()).decode("utf-8")
+        image_format = self.openai_image_format.upper()
+        if image_format == "JPEG":
+            # JPEG has no alpha channel
+            if image.mode != "RGB":
+                image = image.convert("RGB")
+            image.save(image_bytes, format="JPEG", quality=self.openai_image_quality, optimize=False)
+        elif image_format == "WEBP":
+            image.save(image_bytes, format="WEBP", quality=self.openai_image_quality)
+        else:
+            image.save(image_bytes, format=image_format)
+
+        # getbuffer avoids copying the encoded bytes, and the prefix is joined onto the base64 string once
+        return f"data:image/{image_format.lower()};base64," + base64.b64encode(image_bytes.getbuffer()).decode("ascii")
 
     def prepare_images(
         self, images: Union[Image.Image, List[Image.Image]]
@@ -38,35 +231,64 @@ class OpenAIService(BaseService):
         if isinstance(images, Image.Image):
             images = [images]
 
+        if len(images) > 1:
+            urls = list(_ENCODE_EXECUTOR.map(self.image_url, images))
+        else:
+            urls = [self.image_url(img) for img in images]
+
         return [
             {
                 "type": "image_url",
                 "image_url": {
-                    "url": "data:image/webp;base64,{}".format(
-                        self.image_to_base64(img)
-                    ),
+                    "url": url,
                 }
             }
-            for img in images
+            for url in urls
         ]
 
-    def __call__(
+    def response_cache_key(
         self,
         prompt: str,
         image: PIL.Image.Image | List[PIL.Image.Image],
-        block: Block,
-        response_schema: type[BaseModel],
-        max_retries: int | None = None,
-        timeout: int | None = None,
-    ):
-        # 添加调试信息，输出请求的模型名称和输入的消息内容
-        print("\n\n===以下是 marker/services/openai.py 中的反馈 ===")        
-        print(f"🔥 openai.py的__call__中调用的模型名称（执行API调用时，确实会被调用的模型）: {self.openai_model}")  # 显示当前模型
-        # print(
-        #     f"🔥 openai.py 提醒，请求参数-- prompt来自于硬编码，image是图片数据的base64编码格式（当解析PDF文档并将其传递给模型时，PDF中的图片会被转换为 base64 编码，并作为 image 参数传入 API 请求中。）：prompt={prompt}, image={image}")
-
-        # 确保传递的 messages 内容正确
-        messages = [
+        response_schema: type[BaseModel]
+    ) -> str:
+        if isinstance(image, Image.Image):
+            image = [image]
+
+        # Any change to the model, prompt, images or schema produces a new key
+        key = hashlib.blake2b(digest_size=32)
+        for part in (self.openai_model, response_schema.__name__, prompt):
+            key.update(part.encode("utf-8"))
+            key.update(b"\0")
+        for img in image:
+            key.update(self.image_cache_key(img))
+        return key.hexdigest()
+
+    def cache_response(self, cache_key: str | None, response: dict):
+        if cache_key is not None and response:
+            self.response_cache.set(cache_key, response)
+
+    @staticmethod
+    def repair_response(response_text: str) -> str:
+        # OpenAI-compatible endpoints sometimes wrap the JSON in a markdown code fence
+        repaired = response_text.strip()
+        if repaired.startswith("```"):
+            repaired = repaired.removeprefix("```json").removeprefix("```")
+            repaired = repaired.removesuffix("```")
+        return repaired.strip()
+
+    def validate_response(self, response_text: str, response_schema: type[BaseModel]) -> dict:
+        try:
+            return response_schema.model_validate_json(response_text).model_dump()
+        except ValidationError:
+            # Only parse a second time if the repair actually changed something
+            repaired = self.repair_response(response_text)
+            if repaired == response_text:
+                raise
+            return response_schema.model_validate_json(repaired).model_dump()
+
+    def build_messages(self, prompt: str, image: PIL.Image.Image | List[PIL.Image.Image]) -> List[dict]:
+        return [
             {
                 "role": "user",
                 "content": [
@@ -75,24 +297,124 @@ class OpenAIService(BaseService):
                 ],
             }
         ]
-        
-        # 添加调试代码，输出请求的消息内容
-        # print(f"🔥 marker/services/openai.py 中传递的消息: {messages}")  # 输出传递给模型的消息体 
-        
+
+    def batch_enabled(self) -> bool:
+        return self.openai_batch_mode
+
+    def batch(self, prompts: List[dict]) -> List[dict]:
+        results = [{} for _ in prompts]
+        cache_keys = [None] * len(prompts)
+        pending = []
+        for i, prompt_data in enumerate(prompts):
+            if self.response_cache is not None:
+                cache_keys[i] = self.response_cache_key(prompt_data["prompt"], prompt_data["image"], prompt_data["schema"])
+                cached = self.response_cache.get(cache_keys[i])
+                if cached is not None:
+                    results[i] = cached
+                    continue
+            pending.append(i)
+
+        if not pending:
+            return results
+
+        client = self.get_client()
+        lines = []
+        for i in pending:
+            prompt_data = prompts[i]
+            lines.append(json.dumps({
+                "custom_id": str(i),
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": {
+                    "model": self.openai_model,
+                    "messages": self.build_messages(prompt_data["prompt"], prompt_data["image"]),
+                    "response_format": response_format_for(prompt_data["schema"]),
+                },
+            }))
+
+        batch_file = client.files.create(
+            file=("marker_batch.jsonl", "\n".join(lines).encode("utf-8")),
+            purpose="batch"
+        )
+        batch = client.batches.create(
+            input_file_id=batch_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h"
+        )
+        while batch.status not in ("completed", "failed", "expired", "cancelled"):
+            time.sleep(self.openai_batch_poll_interval)
+            batch = client.batches.retrieve(batch.id)
+
+        if batch.output_file_id is None:
+            logger.warning("OpenAI batch %s finished with status %s and no output", batch.id, batch.status)
+            return results
+
+        for line in client.files.content(batch.output_file_id).text.splitlines():
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            response = item.get("response") or {}
+            if response.get("status_code") != 200:
+                continue
+
+            idx = int(item["custom_id"])
+            body = response["body"]
+            usage = body.get("usage") or {}
+            prompts[idx]["block"].update_metadata(llm_tokens_used=usage.get("total_tokens", 0), llm_request_count=1)
+            try:
+                content = body["choices"][0]["message"]["content"] or ""
+                results[idx] = self.validate_response(content, prompts[idx]["schema"])
+            except (ValidationError, KeyError, IndexError, TypeError):
+                continue
+            self.cache_response(cache_keys[idx], results[idx])
+        return results
+
+    def __call__(
+        self,
+        prompt: str,
+        image: PIL.Image.Image | List[PIL.Image.Image],
+        block: Block,
+        response_schema: type[BaseModel],
+        max_retries: int | None = None,
+        timeout: int | None = None,
+    ):
+        cache_key = None
+        if self.response_cache is not None:
+            cache_key = self.response_cache_key(prompt, image, response_schema)
+            cached = self.response_cache.get(cache_key)
+            if cached is not None:
+                return cached
+
+        messages = self.build_messages(prompt, image)
+
+        # 只记录长度和数量, 不格式化包含 base64 图片的 messages
+        logger.debug(
+            "OpenAI request: model=%s, prompt_chars=%d, images=%d",
+            self.openai_model, len(prompt), len(messages[0]["content"]) - 1
+        )
+        if settings.DEBUG_LEVEL == "debug":
+            logger.debug("OpenAI prompt: %s", prompt)
+
         if max_retries is None:
             max_retries = self.max_retries
 
         if timeout is None:
             timeout = self.timeout
 
+        extra_body = None
+        if self.openai_prompt_cache:
+            # Each processor uses its own schema, so it stands in for the prompt template
+            extra_body = {"prompt_cache_key": f"marker-{response_schema.__name__}"}
+
         client = self.get_client()
+        parsed = None
         tries = 0
-        print("🔥 即将调用API，准备发送请求...")
-        
+        validation_tries = 0
         while tries < max_retries:
+            self.wait_for_rate_limit()
             try:
                 # 1. 执行API请求
-                response = client.beta.chat.completions.parse(
+                raw_response = client.beta.chat.completions.with_raw_response.parse(
                     extra_headers={
                         "X-Title": "Marker",
                         "HTTP-Referer": "https://github.com/VikParuchuri/marker"
@@ -100,64 +422,83 @@ class OpenAIService(BaseService):
                     model=self.openai_model,
                     messages=messages,
                     timeout=timeout,
-                    response_format=response_schema,
+                    response_format=response_format_for(response_schema),
+                    extra_body=extra_body,
                 )
+                response = raw_response.parse()
 
-                # 2. 增强调试信息
-                debug_info = {
-                    "status": getattr(response, "status_code", "N/A"),
-                    "model": self.openai_model,
-                    "tries_left": max_retries - tries - 1
-                }
-                print(f"🔥 响应状态: {debug_info}")
-
-                # 3. 获取响应内容（安全方式）
-                response_text = getattr(response.choices[0].message, 'content', '')
-                if not response_text:
-                    raise ValueError("空响应内容")
-
-                # 4. JSON解析增强
-                try:
-                    parsed = json.loads(response_text)
-                    print("✅ 成功解析JSON响应")
-                    return parsed
-                except json.JSONDecodeError:
-                    # 尝试修复常见JSON格式问题
-                    cleaned = response_text.strip()
-                    if cleaned.startswith(('{', '[')) and cleaned.endswith(('}', ']')):
-                        try:
-                            return json.loads(cleaned)
-                        except json.JSONDecodeError as e:
-                            print(f"🛑 修复JSON失败: {e}\n原始内容:\n{response_text[:300]}...")
-                    raise
-
-            except (APITimeoutError, RateLimitError) as e:
-                # 专用错误处理
+            except RateLimitError as e:
+                # 速率限制: 优先使用 Retry-After, 否则指数退避 + 抖动; 所有线程一起暂停
                 tries += 1
-                wait_time = min(tries * 3, 10)  # 上限10秒
-                print(f"⏳ 速率限制/超时({tries}/{max_retries}): {e}. 等待 {wait_time}s...")
-                time.sleep(wait_time)
+                wait_time = self.retry_after(e)
+                if wait_time is None:
+                    wait_time = min(60, 2 ** tries) + random.uniform(0, 1)
+                logger.warning("速率限制(%d/%d): %s. 等待 %.1fs", tries, max_retries, e, wait_time)
+                self.pause_requests(wait_time)
                 continue
 
-            except json.JSONDecodeError as e:
-                print(f"🛑 JSON解析失败: {e}")
-                if tries == max_retries - 1:  # 最后一次尝试
-                    print(f"🔥 原始响应内容:\n{response_text[:500]}...")  # 显示前500字符
+            except (APIConnectionError, InternalServerError) as e:
+                # 超时/网络错误: 较短的指数退避
                 tries += 1
-                time.sleep(1)
+                wait_time = min(10, 2 ** (tries - 1)) + random.uniform(0, 0.5)
+                logger.warning("超时/网络错误(%d/%d): %s. 等待 %.1fs", tries, max_retries, e, wait_time)
+                time.sleep(wait_time)
                 continue
 
             except Exception as e:
-                print(f"🛑 意外错误: {type(e).__name__}: {str(e)}")
-                tries += 1
-                if tries < max_retries:
-                    time.sleep(1)
-                continue
-            
-        print("===以上是 marker/services/openai.py 中的反馈 ===\n")  # 新增行
-        print("❌ 达到最大重试次数，返回空结果")
-        return {}  # 确保始终有返回值
+                logger.error("意外错误, 不再重试: %s: %s", type(e).__name__, e)
+                break
+
+            # 2. 记录用量并根据响应头调整限速; 放在 try 之外, 响应头异常不会让有效响应变成失败
+            total_tokens = response.usage.total_tokens if response.usage else 0
+            block.update_metadata(llm_tokens_used=total_tokens, llm_request_count=1)
+            self.update_rate_limit(raw_response.headers, total_tokens)
+
+            # 3. 获取响应内容（安全方式）, 空内容会在校验时按失败处理
+            response_text = (response.choices[0].message.content if response.choices else None) or ""
+
+            # 4. 用 schema 自带的已编译校验器一次完成 JSON 解析和校验
+            try:
+                parsed = self.validate_response(response_text, response_schema)
+                break
+            except ValidationError as e:
+                # 结构化输出校验失败: 立即重试, 单独计数
+                validation_tries += 1
+                logger.warning("JSON解析失败(%d/%d): %s", validation_tries, self.openai_max_validation_retries, e)
+                if validation_tries > self.openai_max_validation_retries:
+                    break
+
+        if parsed is None:
+            logger.warning("OpenAI 请求失败，返回空结果 (model=%s)", self.openai_model)
+            return {}  # 确保始终有返回值
 
+        # 写缓存放在重试循环之外, 缓存出错不会丢掉已经拿到的响应
+        self.cache_response(cache_key, parsed)
+        return parsed
 
     def get_client(self) -> openai.OpenAI:
-        return openai.OpenAI(api_key=self.openai_api_key, base_url=self.openai_base_url)
+        with self._client_lock:
+            if self._client is None:
+                # Retries are handled in __call__
+                self._client = openai.OpenAI(
+                    api_key=self.openai_api_key,
+                    base_url=self.openai_base_url,
+                    max_retries=0,
+                    timeout=self.timeout
+                )
+            return self._client
+
+    def close(self):
+        with self._client_lock:
+            if self._client is not None:
+                self._client.close()
+                self._client = None
+        if self.response_cache is not None:
+            self.response_cache.close()
+            self.response_cache = None
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
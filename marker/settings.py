@@ -1,6 +1,8 @@
+import functools
+import logging
 import os
 import torch
-from typing import Optional
+from typing import Literal, Optional
 from dotenv import load_dotenv
 from pydantic import Field, computed_field
 from pydantic_settings import BaseSettings
@@ -14,19 +16,34 @@ class LLMServiceType(str, Enum):
     OPENAI = "marker.services.openai.OpenAIService"
 
 # ==================== 加载环境变量 ====================
-def load_environment_variables():
-    # 确保 .env 路径绝对正确
-    env_path = os.path.normpath(os.path.join(os.path.dirname(__file__), "..", "local.env"))
-    print(f"🔍 正在加载环境文件: {env_path}")
+logger = logging.getLogger(__name__)
+
+# 确保 .env 路径绝对正确
+ENV_PATH = os.path.normpath(os.path.join(os.path.dirname(__file__), "..", "local.env"))
+
+
+def mask_secret(value: str | None) -> str:
+    """日志中只显示密钥的最后 3 位"""
+    return '***' + value[-3:] if value else '未设置'
+
+
+@functools.lru_cache(maxsize=2)
+def load_environment_variables(override: bool = True) -> bool:
+    """
+    加载 local.env，返回文件是否存在；有缓存，每个进程只解析一次。
+    override=False 时不覆盖调用方环境中已有的变量（如 CI 密钥）。
+    """
+    logger.debug("🔍 正在加载环境文件: %s", ENV_PATH)
     
-    if os.path.exists(env_path):
-        load_dotenv(env_path, override=True)
-        print("✅ 成功加载的环境变量:")
-        print(f"OPENAI_MODEL={os.getenv('OPENAI_MODEL')}")
-        print(f"OPENAI_API_KEY={os.getenv('OPENAI_API_KEY')}")
-        print(f"OUTPUT_FORMAT={os.getenv('OUTPUT_FORMAT')}\n")
-    else:
-        raise FileNotFoundError(f"❌ 环境文件不存在: {env_path}")
+    if not os.path.exists(ENV_PATH):
+        return False
+
+    load_dotenv(ENV_PATH, override=override)
+    logger.debug(
+        "✅ 成功加载的环境变量: OPENAI_MODEL=%s, OPENAI_API_KEY=%s, OUTPUT_FORMAT=%s",
+        os.getenv('OPENAI_MODEL'), mask_secret(os.getenv('OPENAI_API_KEY')), os.getenv('OUTPUT_FORMAT')
+    )
+    return True
 
 # ==================== 主配置类 ====================
 class Settings(BaseSettings):
@@ -62,6 +79,26 @@ class Settings(BaseSettings):
         description="模型名称 (如 gpt-4.1 或 gemini-2.5-pro-exp-03-25)",
         env="OPENAI_MODEL"
     )
+    OPENAI_BATCH_MODE: bool = Field(
+        default=False,
+        description="通过 OpenAI Batch API 批量提交 LLM 请求（费用约减半，但结果可能需要数小时）",
+        env="OPENAI_BATCH_MODE"
+    )
+    OPENAI_PROMPT_CACHE: bool = Field(
+        default=False,
+        description="请求时附带 prompt_cache_key，相同提示词模板的请求共用服务端的提示词缓存（仅 OpenAI 官方 API 支持）",
+        env="OPENAI_PROMPT_CACHE"
+    )
+    OPENAI_CACHE_PATH: str = Field(
+        default="",
+        description="LLM 响应缓存文件路径（sqlite），重复解析同一文档时跳过相同请求；留空则不缓存",
+        env="OPENAI_CACHE_PATH"
+    )
+    OPENAI_MAX_IMAGE_DIM: int = Field(
+        default=2048,
+        description="发送给 LLM 的图片最长边像素上限，超过则等比缩小",
+        env="OPENAI_MAX_IMAGE_DIM"
+    )
     # ----- 新增 图片格式配置参数 -----
     OUTPUT_IMAGE_FORMAT: str = Field(
         default="png",  # 默认使用PNG格式
@@ -141,6 +178,19 @@ class Settings(BaseSettings):
     )
 
 
+    COMPILE_MODELS: bool = Field(
+        default=False,
+        description="在 CUDA 上开启 Surya 的模型编译和静态 KV 缓存（COMPILE_ALL；首个文档较慢，之后更快）",
+        env="COMPILE_MODELS"
+    )
+
+    MODEL_QUANTIZATION: Literal["none", "int8"] = Field(
+        default="none",
+        description="模型量化方式: int8 在 CPU 上对线性层做动态量化（更快、更省内存，精度略降）",
+        env="MODEL_QUANTIZATION"
+    )
+
+
     # ==================== 添加计算属性（@computed_field） ====================
     @computed_field
     @property
@@ -154,7 +204,11 @@ class Settings(BaseSettings):
     @computed_field
     @property
     def MODEL_DTYPE(self) -> torch.dtype:
-        return torch.bfloat16 if self.TORCH_DEVICE == "cuda" else torch.float32
+        if self.TORCH_DEVICE == "cuda":
+            return torch.bfloat16
+        if self.TORCH_DEVICE == "mps":
+            return torch.float16
+        return torch.float32
 
 
     @computed_field
@@ -168,23 +222,36 @@ class Settings(BaseSettings):
 
 
 # marker/settings.py 最后添加
-settings = Settings()    
+# 先加载 local.env 再构造，使 marker 内部读取的 settings 与 run_marker 使用的是同一份配置
+# 导入时只补充环境中没有的变量，marker_single、服务端、测试等入口的环境变量不会被 local.env 覆盖
+load_environment_variables(override=False)
+settings = Settings()
+
+
+@functools.lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """脚本入口使用：以 local.env 为准（覆盖已有环境变量），并更新导入时构造的同一个 settings"""
+    if not load_environment_variables(override=True):
+        raise FileNotFoundError(f"❌ 环境文件不存在: {ENV_PATH}")
+
+    # 原地更新而不是替换，已经引用 settings 的模块也会看到 local.env 中的值
+    reloaded = Settings()
+    for name in Settings.model_fields:
+        setattr(settings, name, getattr(reloaded, name))
+    return settings
 
 # ==================== 测试函数 ====================
 def validate_settings():
     """验证配置加载是否正确"""
-    # 先加载环境变量
-    load_environment_variables()
-    
-    # 实例化 Settings 类
-    settings = Settings()
+    # 加载环境变量后构造的全局 settings
+    settings = get_settings()
     
     print("\n" + "="*50)
     print("🔍 配置验证结果")
     print(f"LLM 服务: {settings.LLM_SERVICE}")
     print(f"OpenAI 模型: {settings.OPENAI_MODEL}")
     print(f"API 端点: {settings.OPENAI_BASE_URL}")
-    print(f"API 密钥: {'***'+settings.OPENAI_API_KEY[-3:] if settings.OPENAI_API_KEY else '未设置'}")
+    print(f"API 密钥: {mask_secret(settings.OPENAI_API_KEY)}")
     print(f"输出目录: {settings.OUTPUT_DIR}")
     print(f"计算设备: {settings.TORCH_DEVICE}")
     print("="*50 + "\n")
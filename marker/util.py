@@ -1,7 +1,7 @@
 import inspect
 import os
 from importlib import import_module
-from typing import List, Annotated
+from typing import Dict, List, Annotated
 
 import numpy as np
 import requests
@@ -11,13 +11,21 @@ from marker.schema.polygon import PolygonBox
 from marker.settings import settings
 
 
-def strings_to_classes(items: List[str]) -> List[type]:
-    classes = []
-    for item in items:
+# Classes already resolved from their import path, so converters built per document skip the import machinery
+_CLASS_REGISTRY: Dict[str, type] = {}
+
+
+def string_to_class(item: str) -> type:
+    cls = _CLASS_REGISTRY.get(item)
+    if cls is None:
         module_name, class_name = item.rsplit('.', 1)
         module = import_module(module_name)
-        classes.append(getattr(module, class_name))
-    return classes
+        cls = _CLASS_REGISTRY[item] = getattr(module, class_name)
+    return cls
+
+
+def strings_to_classes(items: List[str]) -> List[type]:
+    return [string_to_class(item) for item in items]
 
 
 def classes_to_strings(items: List[type]) -> List[str]:
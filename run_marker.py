@@ -1,14 +1,38 @@
 #!/usr/bin/env python3
 import argparse
+import json
+import logging
 import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait
 from pathlib import Path
 import traceback
 
 # 🌍 确保加载环境变量
-from marker.settings import load_environment_variables, Settings
+from marker.settings import get_settings, mask_secret, Settings
+from marker.logger import configure_logging
 from marker.models import create_model_dict
 from marker.config.parser import ConfigParser
 from marker.converters.pdf import PdfConverter
+from marker.output import text_from_rendered
+from marker.services import BaseService
+from marker.util import string_to_class
+
+
+# 以脚本运行时 __name__ 为 "__main__"，因此使用固定的 logger 名称
+logger = logging.getLogger("run_marker")
+
+
+def set_log_level(level: int):
+    logger.setLevel(level)
+    # DEBUG 时 marker 内部模块（如 marker.services.openai）的调试日志也一起输出，否则保持默认的 WARNING
+    logging.getLogger("marker").setLevel(logging.DEBUG if level <= logging.DEBUG else logging.NOTSET)
+
+
+def configure_run_logging(debug: bool = False):
+    """在入口处配置一次日志：默认 INFO，--debug 时 DEBUG"""
+    configure_logging()
+    set_log_level(logging.DEBUG if debug else logging.INFO)
 
 
 # run_marker.py 顶部：维护输入类型到 Provider/Converter 的映射表
@@ -26,74 +50,41 @@ CONVERTER_MAP = {
     # '.pdf_table': 'marker.converters.table.TableConverter',
 }
 
-import importlib
-from pathlib import Path
-
 def get_converter_class(filepath):
     ext = Path(filepath).suffix.lower()
-    print(f"[DEBUG] 输入文件类型: {ext}")  # 新增
     converter_path = CONVERTER_MAP.get(ext)
-    print(f"[DEBUG] 选择的Converter路径: {converter_path}")  # 新增
+    logger.debug("输入文件类型: %s, 选择的Converter路径: %s", ext, converter_path)
     if not converter_path:
         raise ValueError(f"Unsupported file type: {ext}")
-    module_name, class_name = converter_path.rsplit('.', 1)
-    module = importlib.import_module(module_name)
-    print(f"[DEBUG] 导入的模块: {module_name}, 类: {class_name}")  # 新增
-    return getattr(module, class_name)
+    return string_to_class(converter_path)
 
 def load_and_validate_config() -> Settings:
     """加载并验证配置"""
-    # 1. 加载环境变量
-    load_environment_variables()
+    # 1. 取导入时已加载 local.env 构造的 Settings（进程内只有这一份）
     try:
-        settings = Settings()
-        print(f"✅ 配置验证通过: OPENAI_MODEL={settings.OPENAI_MODEL}")
+        settings = get_settings()
+        logger.info("✅ 配置验证通过: OPENAI_MODEL=%s", settings.OPENAI_MODEL)
         return settings
     except Exception as e:
-        print(f"❌ 配置加载失败: {str(e)}")
-        print("请检查 .env 文件内容示例:")
-        print("OPENAI_MODEL=gemini-2.5-pro-exp-03-25")
-        print("OPENAI_API_KEY=sk-xxx")
-        raise    
-
-    # 2. 创建 Settings 实例
-    settings = Settings()
-    settings.OUTPUT_DIR = os.path.normpath(settings.OUTPUT_DIR)  # 路径标准化
-
-    # 3. 结构化调试输出
-    print("\n" + "="*50)
-    print("🔧 运行前配置验证")
-    print(f"| {'配置项':<20} | {'值':<40} |")
-    print("|----------------------|----------------------------------------|")
-    print(f"| LLM_SERVICE         | {settings.LLM_SERVICE!r:<40} |")
-    print(f"| OPENAI_MODEL        | {settings.OPENAI_MODEL!r:<40} |")
-    print(f"| OPENAI_BASE_URL     | {settings.OPENAI_BASE_URL!r:<40} |")
-    print(f"| OPENAI_API_KEY      | {'***'+settings.OPENAI_API_KEY[-3:] if settings.OPENAI_API_KEY else '未设置':<40} |")
-    print(f"| OUTPUT_DIR          | {settings.OUTPUT_DIR!r:<40} |")
-    print("="*50 + "\n")
-
-    # 4. 关键配置验证
-    if not settings.OPENAI_API_KEY:
-        raise ValueError("❌ 缺少 OPENAI_API_KEY，请在 local.env 中配置")
-    if not settings.OPENAI_MODEL:
-        raise ValueError("❌ 缺少 OPENAI_MODEL，请在 local.env 中配置")
-    if not settings.OPENAI_BASE_URL:
-        raise ValueError("❌ 缺少 OPENAI_BASE_URL，请在 local.env 中配置")
-
-    return settings
-
-def process_pdf(input_path: str, output_dir: str = None) -> str:
-    """主处理流程：解析PDF为Markdown"""
-    # 读取 local.env 和其他配置。
-    settings = load_and_validate_config()
-    
-    # 构造ConfigParser配置
-    config = {
+        logger.error(
+            "❌ 配置加载失败: %s\n请检查 .env 文件内容示例:\nOPENAI_MODEL=gemini-2.5-pro-exp-03-25\nOPENAI_API_KEY=sk-xxx",
+            e
+        )
+        raise
+
+
+def _build_config(settings: Settings, output_dir: str = None) -> dict:
+    """根据 Settings 构造 ConfigParser 配置（纯函数，整个运行只需构造一次）"""
+    return {
         'use_llm': settings.USE_LLM,
         'llm_service': settings.LLM_SERVICE,
         'openai_api_key': settings.OPENAI_API_KEY,
         'openai_model': settings.OPENAI_MODEL,
         'openai_base_url': settings.OPENAI_BASE_URL,
+        'openai_batch_mode': settings.OPENAI_BATCH_MODE,
+        'openai_cache_path': settings.OPENAI_CACHE_PATH,
+        'openai_prompt_cache': settings.OPENAI_PROMPT_CACHE,
+        'openai_max_image_dim': settings.OPENAI_MAX_IMAGE_DIM,
         'output_dir': output_dir or settings.OUTPUT_DIR,
         'output_format': settings.OUTPUT_FORMAT,
         'force_layout_block': settings.FORCE_LAYOUT_BLOCK,        
@@ -102,51 +93,172 @@ def process_pdf(input_path: str, output_dir: str = None) -> str:
         'languages': settings.LANGUAGES,
         'max_retries': settings.MAX_RETRIES,
     }
- 
- 
-     # 添加调试输出（验证LLM配置）
-    print("===以下是 run_marker.py中的系列参数 ===")
-    print(f"🔍 环境变量验证:")
-    print(f"  [USE_LLM] 是否使用: {settings.USE_LLM}")
 
+
+def _log_config(settings: Settings, config: dict):
+    """调试输出（验证LLM配置），调用方需先确认 DEBUG 日志已启用"""
+    lines = [
+        "===以下是 run_marker.py中的系列参数 ===",
+        "🔍 环境变量验证:",
+        f"  [USE_LLM] 是否使用: {settings.USE_LLM}",
+    ]
     if settings.USE_LLM:
-        print(f"  [Settings类] 模型: {settings.OPENAI_MODEL}")
-        print(f"  [os.environ] 模型: {os.getenv('OPENAI_MODEL')}")
-        print(f"  [Settings类] API密钥: {'***'+settings.OPENAI_API_KEY[-3:] if settings.OPENAI_API_KEY else '未设置'}")
-        print(f"  [os.environ] API密钥: {'***'+os.getenv('OPENAI_API_KEY')[-3:] if os.getenv('OPENAI_API_KEY') else '未设置'}")
-        print(f"  API端点: {settings.OPENAI_BASE_URL}")
-        print(f"  服务类型: {settings.LLM_SERVICE}")
-        print(f"✅ [LLM已启用] service={config['llm_service']}, model={config['openai_model']}")
+        lines += [
+            f"  [Settings类] 模型: {settings.OPENAI_MODEL}",
+            f"  [os.environ] 模型: {os.getenv('OPENAI_MODEL')}",
+            f"  [Settings类] API密钥: {mask_secret(settings.OPENAI_API_KEY)}",
+            f"  [os.environ] API密钥: {mask_secret(os.getenv('OPENAI_API_KEY'))}",
+            f"  API端点: {settings.OPENAI_BASE_URL}",
+            f"  服务类型: {settings.LLM_SERVICE}",
+            f"✅ [LLM已启用] service={config['llm_service']}, model={config['openai_model']}",
+        ]
     else:
-        print("🚫 [LLM未启用] 本次不会调用任何大模型（如gpt-4.1），仅使用传统/规则/ocr等流程。")
-        
-    print("--- DEBUG相关参数 ---")    
-    print(f"  DEBUG: {settings.DEBUG}")
-    print(f"  DEBUG_LEVEL {settings.DEBUG_LEVEL}")
-    print("--- FORCE_LAYOUT_BLOCK设置（识别布局设置） ---")
-    print(f"  force_layout_block: {settings.FORCE_LAYOUT_BLOCK}")    
-    print("--- 新增参数验证 ---")
-    print(f"  FORCE_OCR: {settings.FORCE_OCR}")
-    print(f"  PAGE_RANGE: {settings.PAGE_RANGE}")
-    print(f"  LANGUAGES: {settings.LANGUAGES}")
-    print(f"  MAX_RETRIES: {settings.MAX_RETRIES}") 
-    
-    
+        lines.append("🚫 [LLM未启用] 本次不会调用任何大模型（如gpt-4.1），仅使用传统/规则/ocr等流程。")
+
+    lines += [
+        "--- DEBUG相关参数 ---",
+        f"  DEBUG: {settings.DEBUG}",
+        f"  DEBUG_LEVEL {settings.DEBUG_LEVEL}",
+        "--- FORCE_LAYOUT_BLOCK设置（识别布局设置） ---",
+        f"  force_layout_block: {settings.FORCE_LAYOUT_BLOCK}",
+        "--- 新增参数验证 ---",
+        f"  FORCE_OCR: {settings.FORCE_OCR}",
+        f"  PAGE_RANGE: {settings.PAGE_RANGE}",
+        f"  LANGUAGES: {settings.LANGUAGES}",
+        f"  MAX_RETRIES: {settings.MAX_RETRIES}",
+    ]
+    logger.debug("\n".join(lines))
+
+
+def build_pipeline(settings: Settings, output_dir: str = None, thread_safe: bool = False) -> dict:
+    """
+    构造 process_pdf 所需的共享对象（ConfigParser、模型、处理器等），每次运行只构造一次。
+    多个线程各自用一个 Converter 时传入 thread_safe，模型推理会加锁串行执行。
+    """
+    config = _build_config(settings, output_dir)
+    # 只有启用 DEBUG 日志时才构造配置表（包括 API 密钥掩码等字符串）
+    if logger.isEnabledFor(logging.DEBUG):
+        _log_config(settings, config)
+
     config_parser = ConfigParser(config)
-    
+    # Converter 配置只依赖 Settings 和 output_dir，在这里生成一次，之后每个 Converter 直接复用
+    converter_config = config_parser.generate_config_dict()
+    artifact_dict = create_model_dict(thread_safe=thread_safe)
+
+    # 未启用 LLM 时不解析服务类, converter 也就不会实例化 OpenAIService
+    llm_service = None
+    if settings.USE_LLM:
+        # 只构造一个服务实例，所有 Converter 共用它的连接、限速状态和响应缓存
+        llm_service = string_to_class(config_parser.get_llm_service())(converter_config)
+        # Converter 会把服务写入 artifact_dict；提前放入同一个实例，共享的 artifact_dict 就不会被改写
+        artifact_dict["llm_service"] = llm_service
+
+    return {
+        'config': converter_config,
+        'artifact_dict': artifact_dict,
+        'processor_list': config_parser.get_processors(),
+        'renderer': config_parser.get_renderer(),
+        'llm_service': llm_service,
+    }
+
+
+def build_converter(
+    input_path: str,
+    config: dict,
+    artifact_dict: dict,
+    llm_service: BaseService | None,
+    processor_list: list | None,
+    renderer: str,
+):
+    """按输入类型构造 Converter；同类型文件可复用同一个 Converter"""
     # 自动选择 Converter 
     ConverterClass = get_converter_class(input_path)
     # 构造 PDF 转换器 ,将 PDF 转为中间结构（如图片、文本块等）。
-    converter = ConverterClass(
-        config=config_parser.generate_config_dict(),
-        artifact_dict=create_model_dict(),
-        processor_list=config_parser.get_processors(),
-        renderer=config_parser.get_renderer(),
-        llm_service=config_parser.get_llm_service()
+    return ConverterClass(
+        config=config,
+        artifact_dict=artifact_dict,
+        processor_list=processor_list,
+        renderer=renderer,
+        llm_service=llm_service
     )
 
+
+# 每次 os.write 写出的最大字节数
+OUTPUT_CHUNK_SIZE = 1 << 20
+
+
+def write_atomic(path: Path, data: bytes):
+    """先写入同目录下的临时文件并落盘，再原子重命名，中途崩溃或断电不会留下写了一半的结果文件"""
+    tmp_path = path.with_name(path.name + '.tmp')
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        view = memoryview(data)
+        while view:
+            written = os.write(fd, view[:OUTPUT_CHUNK_SIZE])
+            view = view[written:]
+        # 重命名前先落盘，否则断电后部分文件系统上重命名后的文件可能是空的
+        os.fsync(fd)
+    except BaseException:
+        os.close(fd)
+        os.unlink(tmp_path)
+        raise
+    os.close(fd)
+    os.replace(tmp_path, path)
+
+
+def save_outputs(output_path: Path, text: str, metadata: dict, images: dict):
+    """保存文本、metadata 和图片（输出目录需已存在）"""
+    # 保存文本
+    write_atomic(output_path, text.encode('utf-8'))
+
+    # 保存 metadata
+    meta = json.dumps(metadata, indent=2, ensure_ascii=False)
+    write_atomic(output_path.with_name(f"{output_path.stem}_meta.json"), meta.encode('utf-8'))
+    for img_name, img in images.items():
+        img.save(output_path.parent / img_name)
+
+
+def _save_and_return(output_path: Path, *args) -> Path:
+    save_outputs(output_path, *args)
+    return output_path
+
+
+class OutputWriter:
+    """
+    在后台线程写出结果文件，使磁盘写入与下一个文件的解析重叠；可被多个解析线程共用。
+    写出失败不会在这里抛出，而是保存在 submit 返回的 Future 中，由调用方按文件报告。
+    """
+
+    def __init__(self, max_pending: int = 4):
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="marker-writer")
+        self._pending: list[Future] = []
+        self._lock = threading.Lock()
+
+    def submit(self, output_path: Path, *args) -> Future:
+        """排队写出一个文件，返回写出完成后得到 output_path 的 Future"""
+        with self._lock:
+            # 限制排队中的结果数量，避免已解析的文档在内存中堆积；只有一个写线程，按顺序完成
+            while len(self._pending) >= self.max_pending:
+                wait([self._pending.pop(0)])
+            future = self._executor.submit(_save_and_return, output_path, *args)
+            self._pending.append(future)
+            return future
+
+    def close(self):
+        """等待所有写入完成"""
+        with self._lock:
+            self._pending.clear()
+        self._executor.shutdown(wait=True)
+
+
+def convert_one(converter, input_path: str, output_dir: Path, writer: OutputWriter | None = None) -> Path | Future:
+    """
+    用已构造好的 Converter 解析单个文件并保存结果，返回输出路径；
+    传入 writer 时在后台写出，返回写出完成后得到输出路径的 Future。
+    output_dir 由调用方预先创建，这里不再逐个文件 makedirs。
+    """
     # 解析PDF
-    from marker.output import text_from_rendered
     rendered = converter(input_path)
     
     # 使用 text_from_rendered 提取文本、扩展名、图片
@@ -154,32 +266,36 @@ def process_pdf(input_path: str, output_dir: str = None) -> str:
     metadata = getattr(rendered, "metadata", {})
     
     # 构造输出路径
-    output_base = str(Path(config['output_dir']) / f"{Path(input_path).stem}")
-    output_path = f"{output_base}.{ext}"
-    os.makedirs(os.path.dirname(output_path), exist_ok=True)
-    
-    # 保存文本
-    with open(output_path, 'w', encoding='utf-8') as f:
-        f.write(text)
-        
-    # 保存 metadata        
-    with open(f"{output_base}_meta.json", 'w', encoding='utf-8') as f:
-        import json
-        f.write(json.dumps(metadata, indent=2, ensure_ascii=False))
-    for img_name, img in images.items():
-        img_path = os.path.join(os.path.dirname(output_path), img_name)
-        img.save(img_path)    
+    output_path = output_dir / f"{Path(input_path).stem}.{ext}"
 
+    if writer is not None:
+        return writer.submit(output_path, text, metadata, images)
+    save_outputs(output_path, text, metadata, images)
     return output_path
 
+
+def process_pdf(input_path: str, output_dir: str, **pipeline) -> Path:
+    """主处理流程：解析PDF为Markdown"""
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    converter = build_converter(input_path, **pipeline)
+    return convert_one(converter, input_path, output_dir)
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='📄 PDF 转 Markdown 工具')
     parser.add_argument('input_file', help='输入的PDF文件路径')
     parser.add_argument('-o', '--output-dir', help='覆盖默认输出目录')
+    parser.add_argument('-d', '--debug', action='store_true', help='输出调试日志')
     args = parser.parse_args()
+    configure_run_logging(args.debug)
 
     try:
-        output_path = process_pdf(args.input_file, args.output_dir)
+        # 读取 local.env 和其他配置。
+        settings = load_and_validate_config()
+        if settings.DEBUG:
+            set_log_level(logging.DEBUG)
+        output_dir = args.output_dir or settings.OUTPUT_DIR
+        output_path = process_pdf(args.input_file, output_dir, **build_pipeline(settings, output_dir))
         print(f"\n✅ 转换完成！结果保存在: {output_path}")
     except Exception as e:
         print(f"\n❌ 处理失败: {str(e)}")
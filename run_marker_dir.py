@@ -1,9 +1,152 @@
+import argparse
+import itertools
+import logging
+import multiprocessing
 import os
-import sys
+import threading
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait
 from datetime import datetime
-from run_marker import process_pdf
+from pathlib import Path
 
-def process_all_pdfs(input_dir, output_root=None):
+from tqdm import tqdm
+
+from run_marker import (
+    OutputWriter,
+    build_converter,
+    build_pipeline,
+    configure_run_logging,
+    convert_one,
+    load_and_validate_config,
+    logger,
+    set_log_level,
+)
+
+# 遍历目录时每次预取并按大小排序的文件数
+DISCOVERY_PREFETCH = 64
+
+# 每个进程共享的 ConfigParser、模型等（由 _init_worker 构造）
+_pipeline = None
+_sample_pdf = None
+# Converter 在解析过程中保存单个文档的状态，因此每个线程各持有一个
+_local = threading.local()
+# 单进程模式下的后台写出线程；进程池中各进程已经并行，直接同步写出
+_writer = None
+
+
+def _init_worker(
+    output_root: str,
+    sample_pdf: str,
+    torch_threads: int | None = None,
+    log_level: int | None = None,
+    thread_safe: bool = False,
+):
+    global _pipeline, _sample_pdf
+    if log_level is not None:
+        # spawn 启动的进程不会继承主进程的日志配置
+        configure_run_logging()
+        set_log_level(log_level)
+
+    if torch_threads is not None:
+        # 多进程时每个进程只用一个线程，避免 CPU 超额订阅
+        import torch
+        torch.set_num_threads(torch_threads)
+
+    settings = load_and_validate_config()
+    _pipeline = build_pipeline(settings, output_root, thread_safe)
+    _sample_pdf = sample_pdf
+
+
+def _get_converter():
+    """返回当前线程的 Converter；模型和 LLM 服务在线程间共享，只有 Converter 本身按线程构造"""
+    converter = getattr(_local, "converter", None)
+    if converter is None:
+        converter = _local.converter = build_converter(_sample_pdf, **_pipeline)
+    return converter
+
+
+def _convert_task(task):
+    pdf, target_output_dir = task
+    try:
+        return pdf, convert_one(_get_converter(), pdf, target_output_dir, _writer), None
+    except Exception as e:
+        return pdf, None, str(e)
+
+
+def iter_pdf_entries(root: str):
+    """递归遍历目录并逐个产出 PDF 的 DirEntry；DirEntry 自带文件类型，无需额外 stat"""
+    stack = [root]
+    while stack:
+        try:
+            it = os.scandir(stack.pop())
+        except OSError:
+            # 与 os.walk 一致，跳过无法读取的目录
+            continue
+        with it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.name[-4:].lower() == '.pdf' and entry.is_file():
+                    yield entry
+
+
+def _entry_size(entry: os.DirEntry) -> int:
+    # POSIX 上 DirEntry.stat() 仍是一次 stat 系统调用（仅 Windows 由 scandir 缓存），排序时每个文件只调用一次
+    try:
+        return entry.stat().st_size
+    except OSError:
+        return 0
+
+
+def iter_pdf_tasks(input_dir: str, output_root: Path, prefetch: int = DISCOVERY_PREFETCH):
+    """
+    边遍历边产出 (pdf, 输出目录)：每次预取 prefetch 个文件并按大小降序排列，
+    大文件优先而不必等整个目录遍历完；每个输出子目录只创建一次
+    """
+    entries = iter_pdf_entries(input_dir)
+    target_dirs = {}
+    while batch := list(itertools.islice(entries, prefetch)):
+        batch.sort(key=_entry_size, reverse=True)
+        for entry in batch:
+            pdf_dir = os.path.dirname(entry.path)
+            target_output_dir = target_dirs.get(pdf_dir)
+            if target_output_dir is None:
+                target_output_dir = output_root / os.path.relpath(pdf_dir, input_dir)
+                target_output_dir.mkdir(parents=True, exist_ok=True)
+                target_dirs[pdf_dir] = target_output_dir
+            yield entry.path, target_output_dir
+
+
+def _submit_bounded(executor, fn, items, max_in_flight: int):
+    """逐个提交任务并按完成顺序产出结果，同时提交中的任务数不超过 max_in_flight"""
+    pending = set()
+    for item in items:
+        pending.add(executor.submit(fn, item))
+        if len(pending) >= max_in_flight:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+    for future in as_completed(pending):
+        yield future.result()
+
+
+def _report(pbar: tqdm, pdf: str, out_path, error: str | None):
+    if error is None:
+        tqdm.write(f"✅ 完成: {out_path}")
+    else:
+        tqdm.write(f"❌ 处理失败: {pdf}，原因: {error}")
+    pbar.update(1)
+
+
+def _report_write(pbar: tqdm, pdf: str, written: Future):
+    try:
+        _report(pbar, pdf, written.result(), None)
+    except Exception as e:
+        _report(pbar, pdf, None, f"写入失败: {e}")
+
+
+def process_all_pdfs(input_dir, output_root=None, workers=1, llm_pipeline=2):
+    global _writer
     # 1. 生成平行输出根目录
     input_dir = os.path.abspath(input_dir)
     parent_dir = os.path.dirname(input_dir)
@@ -13,31 +156,83 @@ def process_all_pdfs(input_dir, output_root=None):
         output_root = os.path.join(parent_dir, f"{base_name}--解析文件{now_str}")
     if not os.path.exists(output_root):
         os.makedirs(output_root)
-    print(f"输出根目录: {output_root}")
-
-    # 2. 遍历所有PDF，保持目录结构
-    pdf_files = [
-        os.path.join(root, file)
-        for root, _, files in os.walk(input_dir)
-        for file in files if file.lower().endswith('.pdf')
-    ]
-    print(f"共发现 {len(pdf_files)} 个PDF文件。")
-    for pdf in pdf_files:
-        try:
-            # 计算相对路径
-            rel_path = os.path.relpath(os.path.dirname(pdf), input_dir)
-            target_output_dir = os.path.join(output_root, rel_path)
-            os.makedirs(target_output_dir, exist_ok=True)
-            print(f"正在处理: {pdf}")
-            out_path = process_pdf(pdf, target_output_dir)
-            print(f"✅ 完成: {out_path}")
-        except Exception as e:
-            print(f"❌ 处理失败: {pdf}，原因: {e}")
+    logger.info("输出根目录: %s", output_root)
+    output_root = Path(output_root)
+
+    settings = load_and_validate_config()
+    if settings.DEBUG:
+        set_log_level(logging.DEBUG)
+
+    # 2. 遍历所有PDF，保持目录结构；遍历与解析同时进行，第一个文件就可以用来构造 Converter
+    tasks = iter_pdf_tasks(input_dir, output_root)
+    first_task = next(tasks, None)
+    if first_task is None:
+        logger.info("未发现PDF文件。")
+        return
+    tasks = itertools.chain([first_task], tasks)
+    sample_pdf = first_task[0]
+
+    # 多进程只用于 CPU；GPU 上模型已按批推理，多个进程会各自加载一份模型并争抢显存
+    workers = min(workers, os.cpu_count() or 1)
+    if settings.TORCH_DEVICE != "cpu":
+        workers = 1
+
+    pbar = tqdm(desc="Processing PDFs", unit="pdf")
+    if workers > 1:
+        logger.info("使用 %d 个进程并行处理", workers)
+        executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(str(output_root), sample_pdf, 1, logger.getEffectiveLevel()),
+        )
+        # 每个进程除正在处理的文件外最多再排队一个，内存占用不随目录大小增长
+        results = _submit_bounded(executor, _convert_task, tasks, 2 * workers)
+    else:
+        # 所有文件都是 PDF，共用同一份模型（只加载一次）
+        _writer = OutputWriter()
+        threaded = settings.USE_LLM and llm_pipeline > 1
+        # 线程间共享同一份模型，推理需串行（Surya 的 KV 缓存保存在模型上）；LLM 请求仍然并行
+        _init_worker(str(output_root), sample_pdf, thread_safe=threaded)
+        if threaded:
+            # 启用 LLM 时大量时间花在等待网络响应上，同时解析多个 PDF，使等待与其他文件的解析重叠
+            logger.info("同时解析 %d 个PDF以重叠 LLM 请求", llm_pipeline)
+            executor = ThreadPoolExecutor(max_workers=llm_pipeline, thread_name_prefix="marker-convert")
+            results = _submit_bounded(executor, _convert_task, tasks, llm_pipeline)
+        else:
+            executor = None
+            results = map(_convert_task, tasks)
+
+    # 后台写出的文件等写完后再报告，写出失败归到它自己的 PDF 上
+    pending_writes = deque()
+    try:
+        for pdf, out_path, error in results:
+            if isinstance(out_path, Future):
+                pending_writes.append((pdf, out_path))
+            else:
+                _report(pbar, pdf, out_path, error)
+            while pending_writes and pending_writes[0][1].done():
+                _report_write(pbar, *pending_writes.popleft())
+        while pending_writes:
+            _report_write(pbar, *pending_writes.popleft())
+    finally:
+        pbar.close()
+        if executor is not None:
+            executor.shutdown()
+        if _writer is not None:
+            _writer.close()
+            _writer = None
+    logger.info("共处理 %d 个PDF文件。", pbar.n)
+
 
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("用法: python run_marker_dir.py <输入文件夹> [输出根文件夹]")
-        sys.exit(1)
-    input_dir = sys.argv[1]
-    output_root = sys.argv[2] if len(sys.argv) > 2 else None
-    process_all_pdfs(input_dir, output_root)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='📂 批量将文件夹中的 PDF 转为 Markdown（保持目录结构）')
+    parser.add_argument('input_dir', help='输入文件夹')
+    parser.add_argument('output_root', nargs='?', default=None, help='输出根文件夹（默认在输入文件夹旁生成）')
+    parser.add_argument('-w', '--workers', type=int, default=1, help='并行进程数（仅 CPU 模式生效）')
+    parser.add_argument('--llm-pipeline', type=int, default=2, help='启用 LLM 时单进程内同时解析的 PDF 数')
+    parser.add_argument('-d', '--debug', action='store_true', help='输出调试日志')
+    args = parser.parse_args()
+    configure_run_logging(args.debug)
+
+    process_all_pdfs(args.input_dir, args.output_root, args.workers, args.llm_pipeline)
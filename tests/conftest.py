@@ -12,7 +12,7 @@ from marker.builders.layout import LayoutBuilder
 from marker.builders.line import LineBuilder
 from marker.builders.ocr import OcrBuilder
 from marker.converters.pdf import PdfConverter
-from marker.models import create_model_dict
+from marker.models import clear_model_cache, create_model_dict
 from marker.providers.registry import provider_from_filepath
 from marker.schema import BlockTypes
 from marker.schema.blocks import Block
@@ -28,6 +28,7 @@ def model_dict():
     model_dict = create_model_dict()
     yield model_dict
     del model_dict
+    clear_model_cache()
 
 
 @pytest.fixture(scope="session")
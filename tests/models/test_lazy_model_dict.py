@@ -0,0 +1,84 @@
+import pickle
+
+from marker.models import MODEL_CLASSES, LazyModelDict
+
+
+def mock_load_model(mocker):
+    return mocker.patch("marker.models.load_model", side_effect=lambda cls, device, dtype: cls.__name__)
+
+
+def test_lazy_model_dict_contains(mocker):
+    load_model = mock_load_model(mocker)
+    model_dict = LazyModelDict()
+
+    # Dependency resolution checks membership, which must not load anything
+    assert "layout_model" in model_dict
+    assert "llm_service" not in model_dict
+    assert len(model_dict) == len(MODEL_CLASSES)
+    load_model.assert_not_called()
+
+    assert model_dict["layout_model"] == MODEL_CLASSES["layout_model"].__name__
+    assert model_dict["layout_model"] == MODEL_CLASSES["layout_model"].__name__
+    load_model.assert_called_once()
+
+
+def test_lazy_model_dict_set_del(mocker):
+    load_model = mock_load_model(mocker)
+    model_dict = LazyModelDict()
+
+    model_dict["llm_service"] = "service"
+    model_dict["layout_model"] = "override"
+    assert model_dict["llm_service"] == "service"
+    assert model_dict["layout_model"] == "override"
+    assert len(model_dict) == len(MODEL_CLASSES) + 1
+
+    del model_dict["texify_model"]
+    del model_dict["llm_service"]
+    assert "texify_model" not in model_dict
+    assert "llm_service" not in model_dict
+    assert len(model_dict) == len(MODEL_CLASSES) - 1
+    load_model.assert_not_called()
+
+
+def test_lazy_model_dict_items(mocker):
+    load_model = mock_load_model(mocker)
+    model_dict = LazyModelDict()
+
+    # scripts/convert.py iterates over every model to share its memory
+    items = dict(model_dict.items())
+    assert items == {k: cls.__name__ for k, cls in MODEL_CLASSES.items()}
+    assert load_model.call_count == len(MODEL_CLASSES)
+
+
+def test_lazy_model_dict_thread_safe(mocker):
+    predictor = mocker.MagicMock(return_value="result")
+    mocker.patch("marker.models.load_model", return_value=predictor)
+    model_dict = LazyModelDict(thread_safe=True)
+
+    model = model_dict["layout_model"]
+    assert model is model_dict["layout_model"]
+    assert model(["image"], batch_size=2) == "result"
+    predictor.assert_called_once_with(["image"], batch_size=2)
+
+    # Builders set attributes like disable_tqdm on the shared predictor
+    model.disable_tqdm = True
+    assert predictor.disable_tqdm is True
+    assert model.model is predictor.model
+
+
+def test_lazy_model_dict_pickle(mocker):
+    load_model = mock_load_model(mocker)
+    for thread_safe in (False, True):
+        model_dict = LazyModelDict(thread_safe=thread_safe)
+        model_dict["llm_service"] = "service"
+        loaded = model_dict["layout_model"]
+
+        # scripts/convert.py passes the dict to spawned worker processes
+        restored = pickle.loads(pickle.dumps(model_dict))
+        assert restored["llm_service"] == "service"
+        assert isinstance(restored["layout_model"], type(loaded))
+        assert len(restored) == len(model_dict)
+        assert "texify_model" in restored
+
+    # Models loaded before pickling are sent along, the rest still load lazily
+    assert load_model.call_count == 2
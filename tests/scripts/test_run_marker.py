@@ -0,0 +1,79 @@
+import json
+from concurrent.futures import Future
+from types import SimpleNamespace
+
+import pytest
+
+import run_marker
+from run_marker import OutputWriter, convert_one, write_atomic
+
+
+def stub_converter(input_path):
+    return SimpleNamespace(metadata={"source": input_path})
+
+
+def test_write_atomic(tmp_path):
+    target = tmp_path / "out.md"
+    write_atomic(target, b"hello")
+
+    assert target.read_bytes() == b"hello"
+    assert list(tmp_path.iterdir()) == [target]
+
+
+def test_write_atomic_failure_cleans_up(tmp_path, mocker):
+    target = tmp_path / "out.md"
+    target.write_bytes(b"old")
+    mocker.patch("run_marker.os.write", side_effect=OSError("disk full"))
+
+    with pytest.raises(OSError):
+        write_atomic(target, b"new")
+
+    # 原文件保持不变，临时文件被删除
+    assert target.read_bytes() == b"old"
+    assert list(tmp_path.iterdir()) == [target]
+
+
+def test_convert_one(tmp_path, mocker):
+    mocker.patch("run_marker.text_from_rendered", return_value=("text", "md", {}))
+
+    out_path = convert_one(stub_converter, "/data/paper.pdf", tmp_path)
+
+    assert out_path == tmp_path / "paper.md"
+    assert out_path.read_text(encoding="utf-8") == "text"
+    meta = json.loads((tmp_path / "paper_meta.json").read_text(encoding="utf-8"))
+    assert meta == {"source": "/data/paper.pdf"}
+
+
+def test_convert_one_with_writer(tmp_path, mocker):
+    mocker.patch("run_marker.text_from_rendered", return_value=("text", "md", {}))
+    writer = OutputWriter()
+    try:
+        written = convert_one(stub_converter, "/data/paper.pdf", tmp_path, writer)
+        assert isinstance(written, Future)
+        assert written.result() == tmp_path / "paper.md"
+    finally:
+        writer.close()
+    assert (tmp_path / "paper.md").read_text(encoding="utf-8") == "text"
+
+
+def test_output_writer_failure_is_per_file(tmp_path, mocker):
+    save_outputs = run_marker.save_outputs
+
+    def failing_save(output_path, *args):
+        if output_path.stem == "a":
+            raise OSError("disk full")
+        save_outputs(output_path, *args)
+
+    mocker.patch("run_marker.save_outputs", side_effect=failing_save)
+    writer = OutputWriter(max_pending=1)
+    try:
+        # max_pending=1 时提交 b 需要先等待 a 失败，失败不应影响后续文件
+        written_a = writer.submit(tmp_path / "a.md", "a", {}, {})
+        written_b = writer.submit(tmp_path / "b.md", "b", {}, {})
+        assert written_b.result() == tmp_path / "b.md"
+        with pytest.raises(OSError):
+            written_a.result()
+    finally:
+        writer.close()
+    assert not (tmp_path / "a.md").exists()
+    assert (tmp_path / "b.md").read_text(encoding="utf-8") == "b"
@@ -0,0 +1,138 @@
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from types import SimpleNamespace
+
+import run_marker
+import run_marker_dir
+from run_marker_dir import _report_write, _submit_bounded, iter_pdf_tasks, process_all_pdfs
+
+
+def make_pdf(path: Path, size: int):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b"0" * size)
+
+
+def test_iter_pdf_tasks_largest_first(tmp_path):
+    input_dir = tmp_path / "input"
+    sizes = {"a.pdf": 10, "b.PDF": 50, "c.pdf": 30, "d.pdf": 20, "e.pdf": 40}
+    for name, size in sizes.items():
+        make_pdf(input_dir / name, size)
+    (input_dir / "notes.txt").write_text("not a pdf")
+
+    tasks = list(iter_pdf_tasks(str(input_dir), tmp_path / "output", prefetch=2))
+
+    names = [Path(pdf).name for pdf, _ in tasks]
+    assert sorted(names) == sorted(sizes)
+    # 每个预取窗口内按大小降序
+    for start in range(0, len(names), 2):
+        window = [sizes[name] for name in names[start:start + 2]]
+        assert window == sorted(window, reverse=True)
+
+    # 一次预取全部文件时整体按大小降序
+    tasks = list(iter_pdf_tasks(str(input_dir), tmp_path / "output", prefetch=len(sizes)))
+    assert [Path(pdf).name for pdf, _ in tasks] == sorted(sizes, key=sizes.get, reverse=True)
+
+
+def test_iter_pdf_tasks_creates_each_dir_once(tmp_path, mocker):
+    input_dir = tmp_path / "input"
+    output_root = tmp_path / "output"
+    for rel in ["a.pdf", "b.pdf", "sub/c.pdf", "sub/d.pdf", "sub/deeper/e.pdf"]:
+        make_pdf(input_dir / rel, 1)
+    # 预先创建输出根目录，避免 mkdir(parents=True) 递归创建父目录的调用被计入
+    output_root.mkdir()
+    mkdir = mocker.spy(Path, "mkdir")
+
+    tasks = list(iter_pdf_tasks(str(input_dir), output_root, prefetch=2))
+
+    expected = {
+        "a.pdf": output_root,
+        "b.pdf": output_root,
+        "c.pdf": output_root / "sub",
+        "d.pdf": output_root / "sub",
+        "e.pdf": output_root / "sub" / "deeper",
+    }
+    assert {Path(pdf).name: out_dir for pdf, out_dir in tasks} == expected
+    assert mkdir.call_count == 3
+    assert all(out_dir.is_dir() for _, out_dir in tasks)
+
+
+def test_submit_bounded():
+    max_in_flight = 3
+    submitted = 0
+
+    def items():
+        nonlocal submitted
+        for i in range(20):
+            submitted += 1
+            yield i
+
+    def work(i):
+        return i * 2
+
+    results = []
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        for result in _submit_bounded(executor, work, items(), max_in_flight):
+            # 已提交但尚未产出结果的任务数不超过上限
+            assert submitted - len(results) <= max_in_flight
+            results.append(result)
+
+    assert sorted(results) == [i * 2 for i in range(20)]
+
+
+def test_report_write_failure(mocker):
+    write = mocker.patch("run_marker_dir.tqdm.write")
+    pbar = mocker.Mock()
+    written = Future()
+    written.set_exception(OSError("disk full"))
+
+    _report_write(pbar, "a.pdf", written)
+
+    assert "a.pdf" in write.call_args[0][0]
+    assert "写入失败" in write.call_args[0][0]
+    pbar.update.assert_called_once_with(1)
+
+
+def test_process_all_pdfs_reports_per_file(tmp_path, mocker):
+    input_dir = tmp_path / "input"
+    output_root = tmp_path / "output"
+    for rel in ["good.pdf", "bad.pdf", "unwritable.pdf", "sub/nested.pdf"]:
+        make_pdf(input_dir / rel, 1)
+
+    def converter(input_path):
+        if Path(input_path).stem == "bad":
+            raise ValueError("broken pdf")
+        return SimpleNamespace(metadata={})
+
+    save_outputs = run_marker.save_outputs
+
+    def failing_save(output_path, *args):
+        if output_path.stem == "unwritable":
+            raise OSError("disk full")
+        save_outputs(output_path, *args)
+
+    mocker.patch("run_marker.save_outputs", side_effect=failing_save)
+    mocker.patch("run_marker.text_from_rendered", return_value=("text", "md", {}))
+    mocker.patch(
+        "run_marker_dir.load_and_validate_config",
+        return_value=SimpleNamespace(DEBUG=False, TORCH_DEVICE="cpu", USE_LLM=False),
+    )
+    mocker.patch("run_marker_dir.build_pipeline", return_value={})
+    mocker.patch("run_marker_dir.build_converter", return_value=converter)
+    mocker.patch.object(run_marker_dir, "_local", threading.local())
+    write = mocker.patch("run_marker_dir.tqdm.write")
+
+    process_all_pdfs(str(input_dir), str(output_root))
+
+    messages = [call[0][0] for call in write.call_args_list]
+    assert len(messages) == 4
+    failures = [message for message in messages if message.startswith("❌")]
+    assert len(failures) == 2
+    assert any("bad.pdf" in message and "broken pdf" in message for message in failures)
+    assert any("unwritable.pdf" in message and "写入失败" in message for message in failures)
+
+    assert (output_root / "good.md").read_text(encoding="utf-8") == "text"
+    assert (output_root / "sub" / "nested.md").read_text(encoding="utf-8") == "text"
+    assert not (output_root / "bad.md").exists()
+    assert not (output_root / "unwritable.md").exists()
+    assert run_marker_dir._writer is None
@@ -0,0 +1,257 @@
+import base64
+import json
+import sqlite3
+from io import BytesIO
+
+import httpx
+from openai import RateLimitError
+from PIL import Image
+from pydantic import BaseModel
+
+from marker.services.openai import OpenAIService
+
+
+class AnswerSchema(BaseModel):
+    answer: str
+
+
+def test_openai_image_jpeg():
+    service = OpenAIService({"openai_api_key": "test"})
+    image = Image.new("RGBA", (64, 32), (255, 0, 0, 128))
+
+    parts = service.prepare_images(image)
+    assert len(parts) == 1
+
+    url = parts[0]["image_url"]["url"]
+    assert url.startswith("data:image/jpeg;base64,")
+
+    decoded = Image.open(BytesIO(base64.b64decode(url.split(",", 1)[1])))
+    assert decoded.format == "JPEG"
+    assert decoded.size == (64, 32)
+
+
+def test_openai_image_format_override():
+    service = OpenAIService({"openai_api_key": "test", "openai_image_format": "PNG"})
+    image = Image.new("RGB", (16, 16))
+
+    url = service.prepare_images([image, image])[1]["image_url"]["url"]
+    assert url.startswith("data:image/png;base64,")
+
+
+def test_openai_prepare_images_order():
+    service = OpenAIService({"openai_api_key": "test"})
+    images = [Image.new("RGB", (8 * (i + 1), 8)) for i in range(4)]
+
+    parts = service.prepare_images(images)
+    sizes = [
+        Image.open(BytesIO(base64.b64decode(p["image_url"]["url"].split(",", 1)[1]))).size
+        for p in parts
+    ]
+    assert sizes == [img.size for img in images]
+
+
+def test_openai_image_cache(mocker):
+    service = OpenAIService({"openai_api_key": "test", "openai_image_cache_size": 2})
+    encode = mocker.spy(service, "render_image_url")
+    images = [Image.new("RGB", (8, 8), (i, 0, 0)) for i in range(3)]
+
+    first = service.image_url(images[0])
+    assert service.image_url(images[0].copy()) == first
+    assert encode.call_count == 1
+
+    service.image_url(images[1])
+    service.image_url(images[2])
+    assert len(service._image_url_cache) == 2
+
+    # The oldest entry was evicted
+    service.image_url(images[0])
+    assert encode.call_count == 4
+
+
+def test_openai_rate_limit_headers():
+    service = OpenAIService({"openai_api_key": "test"})
+
+    service.update_rate_limit({"x-ratelimit-remaining-requests": "10", "x-ratelimit-remaining-tokens": "5000"}, 100)
+    assert service._rate_limit_until == 0.
+
+    service.update_rate_limit({
+        "x-ratelimit-remaining-requests": "0",
+        "x-ratelimit-reset-requests": "6m0s",
+        "x-ratelimit-remaining-tokens": "50",
+        "x-ratelimit-reset-tokens": "20ms",
+    }, 100)
+    assert service._rate_limit_until > 0.
+
+    # Headers that aren't integers are ignored instead of failing the request
+    service._rate_limit_until = 0.
+    service.update_rate_limit({"x-ratelimit-remaining-requests": "12.5", "x-ratelimit-remaining-tokens": "n/a"}, 100)
+    assert service._rate_limit_until == 0.
+
+
+def test_openai_batch(mocker):
+    service = OpenAIService({"openai_api_key": "test", "openai_batch_mode": True})
+    assert service.batch_enabled()
+
+    client = mocker.MagicMock()
+    client.batches.create.return_value = mocker.MagicMock(status="completed", output_file_id="out")
+    client.files.content.return_value.text = "\n".join([
+        json.dumps({"custom_id": "1", "response": {"status_code": 200, "body": {
+            "usage": {"total_tokens": 12},
+            "choices": [{"message": {"content": '{"answer": "b"}'}}]
+        }}}),
+        json.dumps({"custom_id": "0", "response": {"status_code": 500, "body": {}}}),
+    ])
+    mocker.patch.object(service, "get_client", return_value=client)
+
+    blocks = [mocker.MagicMock(), mocker.MagicMock()]
+    prompts = [
+        {"prompt": f"prompt {i}", "image": Image.new("RGB", (8, 8)), "block": blocks[i], "schema": AnswerSchema}
+        for i in range(2)
+    ]
+    results = service.batch(prompts)
+
+    assert results == [{}, {"answer": "b"}]
+    blocks[1].update_metadata.assert_called_once_with(llm_tokens_used=12, llm_request_count=1)
+    blocks[0].update_metadata.assert_not_called()
+
+
+def test_openai_batch_response_cache(mocker, tmp_path):
+    service = OpenAIService({
+        "openai_api_key": "test",
+        "openai_batch_mode": True,
+        "openai_cache_path": str(tmp_path / "cache.sqlite")
+    })
+    client = mocker.MagicMock()
+    client.batches.create.return_value = mocker.MagicMock(status="completed", output_file_id="out")
+    client.files.content.return_value.text = json.dumps({"custom_id": "1", "response": {"status_code": 200, "body": {
+        "choices": [{"message": {"content": '{"answer": "b"}'}}]
+    }}})
+    mocker.patch.object(service, "get_client", return_value=client)
+
+    prompts = [
+        {"prompt": f"prompt {i}", "image": Image.new("RGB", (8, 8)), "block": mocker.MagicMock(), "schema": AnswerSchema}
+        for i in range(2)
+    ]
+    service.cache_response(service.response_cache_key("prompt 0", prompts[0]["image"], AnswerSchema), {"answer": "a"})
+
+    # Only the uncached prompt is submitted
+    assert service.batch(prompts) == [{"answer": "a"}, {"answer": "b"}]
+    batch_lines = client.files.create.call_args.kwargs["file"][1].decode("utf-8").splitlines()
+    assert [json.loads(line)["custom_id"] for line in batch_lines] == ["1"]
+
+    # A rerun is served entirely from the cache
+    client.reset_mock()
+    assert service.batch(prompts) == [{"answer": "a"}, {"answer": "b"}]
+    client.files.create.assert_not_called()
+
+
+def mock_openai_client(mocker, content: str):
+    client = mocker.MagicMock()
+    raw_response = client.beta.chat.completions.with_raw_response.parse.return_value
+    raw_response.headers = {}
+    response = raw_response.parse.return_value
+    response.choices[0].message.content = content
+    response.usage.total_tokens = 10
+    return client
+
+
+def test_openai_response_cache(mocker, tmp_path):
+    config = {"openai_api_key": "test", "openai_cache_path": str(tmp_path / "cache.sqlite")}
+    image = Image.new("RGB", (8, 8))
+
+    service = OpenAIService(config)
+    client = mock_openai_client(mocker, '{"answer": "a"}')
+    mocker.patch.object(service, "get_client", return_value=client)
+    block = mocker.MagicMock()
+    assert service("prompt", image, block, AnswerSchema) == {"answer": "a"}
+    block.update_metadata.assert_called_once_with(llm_tokens_used=10, llm_request_count=1)
+
+    # A new service instance reads the response back from disk
+    service = OpenAIService(config)
+    mocker.patch.object(service, "get_client", return_value=client)
+    assert service("prompt", image, mocker.MagicMock(), AnswerSchema) == {"answer": "a"}
+    assert client.beta.chat.completions.with_raw_response.parse.call_count == 1
+
+    service("other prompt", image, mocker.MagicMock(), AnswerSchema)
+    assert client.beta.chat.completions.with_raw_response.parse.call_count == 2
+
+
+def test_openai_response_cache_error(mocker, tmp_path):
+    service = OpenAIService({"openai_api_key": "test", "openai_cache_path": str(tmp_path / "cache.sqlite")})
+    client = mock_openai_client(mocker, '{"answer": "a"}')
+    mocker.patch.object(service, "get_client", return_value=client)
+
+    # A locked database is a cache miss, and never discards the response
+    service.response_cache._conn = mocker.MagicMock()
+    service.response_cache._conn.execute.side_effect = sqlite3.OperationalError("database is locked")
+    assert service("prompt", Image.new("RGB", (8, 8)), mocker.MagicMock(), AnswerSchema) == {"answer": "a"}
+    assert client.beta.chat.completions.with_raw_response.parse.call_count == 1
+
+
+def test_openai_retry_policy(mocker):
+    sleep = mocker.patch("marker.services.openai.time.sleep")
+    service = OpenAIService({"openai_api_key": "test", "openai_max_validation_retries": 2})
+    client = mock_openai_client(mocker, "not json")
+    mocker.patch.object(service, "get_client", return_value=client)
+    parse = client.beta.chat.completions.with_raw_response.parse
+
+    # Invalid JSON is retried immediately, on its own counter
+    assert service("prompt", Image.new("RGB", (8, 8)), mocker.MagicMock(), AnswerSchema) == {}
+    assert parse.call_count == 3
+    sleep.assert_not_called()
+
+    # Unexpected errors are not retried
+    parse.reset_mock()
+    parse.side_effect = KeyError("boom")
+    assert service("prompt", Image.new("RGB", (8, 8)), mocker.MagicMock(), AnswerSchema) == {}
+    assert parse.call_count == 1
+
+
+def test_openai_rate_limit_error_pauses_all_requests(mocker):
+    sleep = mocker.patch("marker.services.openai.time.sleep")
+    service = OpenAIService({"openai_api_key": "test"})
+    client = mock_openai_client(mocker, '{"answer": "a"}')
+    mocker.patch.object(service, "get_client", return_value=client)
+    parse = client.beta.chat.completions.with_raw_response.parse
+    response = httpx.Response(429, headers={"retry-after": "5"}, request=httpx.Request("POST", "https://api.openai.com/v1"))
+    parse.side_effect = [RateLimitError("rate limited", response=response, body=None), parse.return_value]
+
+    assert service("prompt", Image.new("RGB", (8, 8)), mocker.MagicMock(), AnswerSchema) == {"answer": "a"}
+    # The Retry-After pause is shared, so other threads wait too
+    assert service._rate_limit_until > 0.
+    assert 4 < sleep.call_args.args[0] <= 5
+
+
+def test_openai_client_reused():
+    service = OpenAIService({"openai_api_key": "test"})
+    client = service.get_client()
+    assert service.get_client() is client
+    assert client.max_retries == 0
+
+    service.close()
+    assert service.get_client() is not client
+
+
+def test_openai_image_downscale():
+    service = OpenAIService({"openai_api_key": "test", "openai_max_image_dim": 100})
+    image = Image.new("RGB", (400, 200))
+
+    decoded = Image.open(BytesIO(base64.b64decode(service.image_url(image).split(",", 1)[1])))
+    assert decoded.size == (100, 50)
+    assert image.size == (400, 200)
+
+
+def test_openai_validate_response():
+    service = OpenAIService({"openai_api_key": "test"})
+    assert service.validate_response('{"answer": "a"}', AnswerSchema) == {"answer": "a"}
+    assert service.validate_response('```json\n{"answer": "a"}\n```', AnswerSchema) == {"answer": "a"}
+
+
+def test_openai_prompt_cache_key(mocker):
+    service = OpenAIService({"openai_api_key": "test", "openai_prompt_cache": True})
+    client = mock_openai_client(mocker, '{"answer": "a"}')
+    mocker.patch.object(service, "get_client", return_value=client)
+
+    service("prompt", Image.new("RGB", (8, 8)), mocker.MagicMock(), AnswerSchema)
+    kwargs = client.beta.chat.completions.with_raw_response.parse.call_args.kwargs
+    assert kwargs["extra_body"] == {"prompt_cache_key": "marker-AnswerSchema"}